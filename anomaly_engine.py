@@ -1,34 +1,121 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
 import pandas as pd
 from pyod.models.iforest import IForest
 
-def detect_anomalies(logs):
+LOG_COLUMNS = ["timestamp", "user", "ip", "event_type", "device"]
+FEATURE_COLUMNS = ["failed_login", "login", "after_hours"]
+
+# Below this many users, fall back to a closed-form z-score instead of fitting IForest
+MIN_USERS_FOR_IFOREST = 10
+SMALL_TENANT_Z_THRESHOLD = 1.5
+
+# Fitted IForest models keyed by a digest of their training matrix, so repeated
+# /analyze calls over unchanged logs skip the fit entirely
+_MODEL_CACHE_SIZE = 32
+_model_cache: "OrderedDict[bytes, IForest]" = OrderedDict()
+_model_cache_lock = threading.Lock()
+
+
+def _matrix_key(X: np.ndarray) -> bytes:
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str((X.shape, X.dtype.str)).encode())
+    digest.update(X.tobytes())
+    return digest.digest()
+
+
+def _score_users(X: np.ndarray):
+    """
+    Return (scores, labels) for X, reusing a cached fit when the exact
+    same training matrix has been seen before.
+    """
+    key = _matrix_key(X)
+    with _model_cache_lock:
+        model = _model_cache.get(key)
+        if model is not None:
+            _model_cache.move_to_end(key)
+
+    if model is not None:
+        return model.decision_function(X), model.predict(X)
+
+    model = IForest(contamination=0.2, n_jobs=-1)
+    model.fit(X)
+
+    with _model_cache_lock:
+        _model_cache[key] = model
+        while len(_model_cache) > _MODEL_CACHE_SIZE:
+            _model_cache.popitem(last=False)
+
+    return model.decision_scores_, model.labels_
+
+
+def _category_contains(col: pd.Series, needle: str) -> np.ndarray:
+    """Case-insensitive substring match evaluated per category, then broadcast by code."""
+    categories = col.cat.categories.astype(str).str.lower()
+    hits = np.append(categories.str.contains(needle, regex=False), False)
+    # Null entries have code -1, which lands on the trailing False
+    return hits[col.cat.codes.to_numpy()]
+
+
+def detect_anomalies(logs) -> pd.DataFrame:
+    """
+    Aggregate logs per user and score each user for anomalous activity.
+
+    Returns one row per user; this frame is what the rest of the pipeline
+    (risk, correlation) enriches column-wise.
+    """
 
     if len(logs) == 0:
-        return []
+        return pd.DataFrame()
 
-    df = pd.DataFrame(logs)
+    # Accept either raw log dicts or a DataFrame already loaded from storage;
+    # only the known log fields are kept so missing keys become null columns
+    if isinstance(logs, pd.DataFrame):
+        df = logs.reindex(columns=LOG_COLUMNS)
+    else:
+        df = pd.DataFrame.from_records(logs, columns=LOG_COLUMNS)
 
-    # Safe string handling for event_type (SIEM/EDR may have nulls or missing keys)
-    event_type = df.get("event_type", pd.Series([""] * len(df)))
-    event_str = event_type.fillna("").astype(str).str.lower()
+    # Dictionary-encode the low-cardinality string columns: string matching then
+    # runs once per distinct value and grouping reuses the integer codes
+    df["user"] = df["user"].astype("category")
+    df["event_type"] = df["event_type"].astype("category")
 
-    df["failed_login"] = event_str.str.contains("fail", regex=False).astype(int)
-    df["login"] = event_str.str.contains("login", regex=False).astype(int)
+    # Safe string handling for event_type (SIEM/EDR may have nulls or missing keys)
+    df["failed_login"] = _category_contains(df["event_type"], "fail").astype(int)
+    df["login"] = _category_contains(df["event_type"], "login").astype(int)
 
-    ts = pd.to_datetime(df["timestamp"], errors="coerce")
+    ts = pd.to_datetime(df["timestamp"], format="ISO8601", errors="coerce", utc=True)
     df["after_hours"] = (ts.dt.hour < 6) | (ts.dt.hour > 22)
     df["after_hours"] = df["after_hours"].fillna(False).astype(int)
 
-    user_stats = df.groupby("user").agg({
-        "failed_login": "sum",
-        "login": "sum",
-        "after_hours": "sum"
-    }).reset_index()
+    # Per-user sums via category codes + bincount (same rows/order as groupby("user").sum())
+    codes = df["user"].cat.codes.to_numpy()
+    users = df["user"].cat.categories
+    valid = codes >= 0  # drop logs with a missing user, as groupby does
+    codes = codes[valid]
+    user_stats = pd.DataFrame({"user": users})
+    for col in FEATURE_COLUMNS:
+        sums = np.bincount(codes, weights=df[col].to_numpy()[valid], minlength=len(users))
+        user_stats[col] = sums.astype(np.int64)
+
+    if len(user_stats) < MIN_USERS_FOR_IFOREST:
+        # Too few users for an isolation forest to mean anything; use a z-score
+        # of the weighted failure/after-hours counts instead
+        raw = user_stats["failed_login"] * 2 + user_stats["after_hours"]
+        mu, sigma = raw.mean(), raw.std()
+        if not sigma or np.isnan(sigma):
+            sigma = 1.0
+        user_stats["anomaly_score"] = ((raw - mu) / sigma).clip(lower=0.0)
+        user_stats["is_anomaly"] = (user_stats["anomaly_score"] > SMALL_TENANT_Z_THRESHOLD).astype(int)
+        return user_stats
 
-    model = IForest(contamination=0.2)
-    model.fit(user_stats[["failed_login", "login", "after_hours"]])
+    X = np.ascontiguousarray(user_stats[FEATURE_COLUMNS].to_numpy())
+    scores, labels = _score_users(X)
 
-    user_stats["anomaly_score"] = model.decision_scores_
-    user_stats["is_anomaly"] = model.labels_
+    user_stats["anomaly_score"] = scores
+    user_stats["is_anomaly"] = labels
 
-    return user_stats.to_dict(orient="records")
+    return user_stats
@@ -1,8 +1,20 @@
-from collections import defaultdict
 from typing import Dict, List
 
+import numpy as np
+import pandas as pd
 
-def correlate_patterns(user_records: List[Dict]) -> List[Dict]:
+from risk_engine import numeric_column
+
+
+def _object_column(user_stats: pd.DataFrame, name: str) -> List:
+    """Column values as Python objects, with missing entries (or a missing column) as None."""
+    if name not in user_stats.columns:
+        return [None] * len(user_stats)
+    col = user_stats[name].astype(object)
+    return col.where(col.notna(), None).tolist()
+
+
+def correlate_patterns(user_stats: pd.DataFrame) -> pd.DataFrame:
     """
     Enrich user-level risk records with incident-style correlation.
 
@@ -12,43 +24,51 @@ def correlate_patterns(user_records: List[Dict]) -> List[Dict]:
       - Assigning a stable incident ID that can be tracked end-to-end
 
     The function does not drop any records; instead it annotates them
-    with correlation metadata that the playbook engine can leverage.
+    with correlation metadata that the playbook engine can leverage
+    (`incident_id` and `correlated_users` columns on the per-user frame).
     """
 
-    if not user_records:
-        return []
-
-    # Index users by risk band to quickly find peers with similar risk
-    risk_buckets: Dict[int, List[Dict]] = defaultdict(list)
-    for rec in user_records:
-        band = int((rec.get("risk_score", 0.0) or 0.0) // 10)  # 0–9, 10–19, ...
-        risk_buckets[band].append(rec)
+    if user_stats.empty:
+        return user_stats
 
-    # Build correlation sets
-    for rec in user_records:
-        user_id = rec.get("user") or rec.get("primary_user") or "unknown"
-        risk_score = float(rec.get("risk_score", 0.0) or 0.0)
-        fidelity = float(rec.get("fidelity_score", 0.0) or 0.0)
+    n = len(user_stats)
+    user_ids = [
+        user or primary or "unknown"
+        for user, primary in zip(_object_column(user_stats, "user"), _object_column(user_stats, "primary_user"))
+    ]
+    risk_arr = numeric_column(user_stats, "risk_score")
+    fidelity_arr = numeric_column(user_stats, "fidelity_score")
+    band_arr = (risk_arr // 10).astype(np.int64)  # 0–9, 10–19, ...
 
-        band = int(risk_score // 10)
-        peers = risk_buckets.get(band, [])
+    # Incident suffix per distinct user, so hashing/formatting happens once per user
+    incident_suffix: Dict[str, str] = {
+        user_id: f"{hash(user_id) % 10_000:04d}" for user_id in set(user_ids)
+    }
 
-        correlated_users = []
-        for peer in peers:
-            peer_id = peer.get("user") or peer.get("primary_user") or "unknown"
-            if peer_id == user_id:
-                continue
-            # Require reasonably similar fidelity to avoid over-correlation
-            peer_fidelity = float(peer.get("fidelity_score", 0.0) or 0.0)
-            if abs(peer_fidelity - fidelity) <= 15:
-                correlated_users.append(peer_id)
+    # Group users by risk band to quickly find peers with similar risk. Within a
+    # band, members are ordered by fidelity so every peer window of +/-15 is
+    # located with one vectorised binary search per band.
+    correlated: List[List[str]] = [[] for _ in range(n)]
+    by_band = np.argsort(band_arr, kind="stable")
+    _, band_starts = np.unique(band_arr[by_band], return_index=True)
+    for members in np.split(by_band, band_starts[1:]):
+        members = members[np.argsort(fidelity_arr[members], kind="stable")]
+        fidelities = fidelity_arr[members]
 
-        # Attach a lightweight incident identifier that is deterministic
-        high_risk_flag = "H" if risk_score >= 70 else "L"
-        incident_id = f"INC-{high_risk_flag}-{hash(user_id) % 10_000:04d}"
+        # Require reasonably similar fidelity to avoid over-correlation
+        lo = np.searchsorted(fidelities, fidelities - 15, side="left")
+        hi = np.searchsorted(fidelities, fidelities + 15, side="right")
 
-        rec["incident_id"] = incident_id
-        rec["correlated_users"] = sorted(set(correlated_users))
+        peer_ids = [user_ids[j] for j in members.tolist()]
+        for idx, start, end in zip(members.tolist(), lo.tolist(), hi.tolist()):
+            user_id = user_ids[idx]
+            correlated[idx] = [peer_id for peer_id in peer_ids[start:end] if peer_id != user_id]
 
-    return user_records
+    # Attach a lightweight incident identifier that is deterministic
+    high_risk_flags = np.where(risk_arr >= 70, "H", "L").tolist()
+    user_stats["incident_id"] = [
+        f"INC-{flag}-{incident_suffix[user_id]}" for flag, user_id in zip(high_risk_flags, user_ids)
+    ]
+    user_stats["correlated_users"] = [sorted(set(peers)) for peers in correlated]
 
+    return user_stats
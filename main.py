@@ -1,22 +1,82 @@
+import asyncio
+import logging
 from concurrent.futures import TimeoutError as FuturesTimeoutError
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import List
 
+import orjson
 from fastapi import FastAPI
 from fastapi.responses import JSONResponse, HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.openapi.docs import get_swagger_ui_html
 
 from models import SecurityLog
-from storage import save_logs, load_logs
+from storage import (
+    ES_INDEX_QUEUE_SIZE,
+    get_es_client,
+    load_logs_frame,
+    run_index_worker,
+    save_logs,
+)
 from anomaly_engine import detect_anomalies
 from risk_engine import compute_risk
 from correlation_engine import correlate_patterns
 from playbook_engine import generate_playbook
 from ueba_engine import compute_ueba_scores
 
-app = FastAPI(title="Barclays AI Cyber Agent", docs_url=None)  # we serve custom /docs below
+logger = logging.getLogger(__name__)
+
+# Shared pool for time-bounded UEBA runs; reused across requests instead of per call
+_UEBA_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ueba")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Elasticsearch indexing runs in a background task fed by /ingest. The queue
+    # only exists while a worker is draining it, so a missing or failed ES setup
+    # can never back up local ingest.
+    app.state.index_queue = None
+    worker = None
+    client = get_es_client()
+    if client is not None:
+        index_queue = asyncio.Queue(maxsize=ES_INDEX_QUEUE_SIZE)
+        worker = asyncio.create_task(run_index_worker(index_queue, client))
+
+        def _on_worker_done(task: asyncio.Task) -> None:
+            app.state.index_queue = None
+            if not task.cancelled() and task.exception() is not None:
+                logger.warning("Elasticsearch index worker stopped", exc_info=task.exception())
+
+        worker.add_done_callback(_on_worker_done)
+        app.state.index_queue = index_queue
+
+    yield
+
+    if worker is not None:
+        worker.cancel()
+        try:
+            await worker
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            pass  # already logged by _on_worker_done
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson, which also handles NumPy scalars natively."""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+
+app = FastAPI(
+    title="Barclays AI Cyber Agent",
+    docs_url=None,  # we serve custom /docs below
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 # Where to edit how /docs looks: project folder "static" -> docs-theme.css
 static_dir = Path(__file__).parent / "static"
@@ -24,8 +84,7 @@ if static_dir.exists():
     app.mount("/static", StaticFiles(directory=str(static_dir)), name="static")
 
 
-@app.get("/docs", include_in_schema=False)
-def custom_swagger_ui():
+def _build_docs_html() -> str:
     html_resp = get_swagger_ui_html(
         openapi_url=app.openapi_url,
         title=app.title + " – API Docs",
@@ -42,18 +101,46 @@ def custom_swagger_ui():
         decoded = decoded.replace("</body>", inject + "\n</body>")
     else:
         decoded = decoded.replace("</head>", inject + "\n</head>")
-    return HTMLResponse(decoded)
+    return decoded
+
+
+# The docs page is static, so render it once at import rather than per request
+_DOCS_HTML = _build_docs_html()
+
+
+@app.get("/docs", include_in_schema=False)
+def custom_swagger_ui():
+    return HTMLResponse(_DOCS_HTML)
 
 
 @app.post("/ingest")
-def ingest_logs(logs: List[SecurityLog]):
+async def ingest_logs(logs: List[SecurityLog]):
     """
     Ingest raw security alerts/logs from SIEM, EDR, or other banking systems.
 
-    Logs are durably stored locally and optionally indexed into Elasticsearch.
+    Logs are durably stored locally and optionally indexed into Elasticsearch
+    by a background worker, so indexing latency never delays the response.
     """
+    index_queue = app.state.index_queue
+    if index_queue is not None and index_queue.full():
+        # Indexer is behind; ask the sender to retry rather than buffering unbounded
+        return JSONResponse(
+            status_code=503,
+            content={"error": "Ingest backlog full, retry later"},
+            headers={"Retry-After": "1"},
+        )
+
     log_dicts = [log.dict() for log in logs]
-    save_logs(log_dicts)
+    await save_logs(log_dicts)
+
+    # Re-read: the worker may have stopped while we were writing
+    index_queue = app.state.index_queue
+    if index_queue is not None and log_dicts:
+        try:
+            index_queue.put_nowait(log_dicts)
+        except asyncio.QueueFull:
+            # Filled up while we were writing; logs are already stored, so skip indexing them
+            logger.warning("Index queue full; %d stored logs not sent to Elasticsearch", len(log_dicts))
 
     return {
         "status": "success",
@@ -73,44 +160,45 @@ def analyze_logs():
       6. Generate a tailored response playbook (LLM/rule-based)
     """
     try:
-        logs = load_logs()
+        logs = load_logs_frame()
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": "Failed to load logs", "detail": str(e)})
 
-    if not logs:
+    if logs.empty:
         return {"error": "No logs available"}
 
     try:
-        # 1) Per-user anomaly detection
-        user_records = detect_anomalies(logs)
-        if not user_records:
+        # 1) Per-user anomaly detection; the per-user frame flows through every stage
+        user_stats = detect_anomalies(logs)
+        if user_stats.empty:
             return {"total_users": 0, "analysis": [], "message": "No user aggregates from logs"}
 
         # 2) Behavioural analytics via UEBA (time-bounded so docs never hang)
         try:
-            with ThreadPoolExecutor(max_workers=1) as ex:
-                future = ex.submit(compute_ueba_scores, logs)
-                ueba_scores = future.result(timeout=15)
+            future = _UEBA_EXECUTOR.submit(compute_ueba_scores, logs)
+            ueba_scores = future.result(timeout=15)
         except (FuturesTimeoutError, Exception):
             ueba_scores = {}
-        for record in user_records:
-            user_id = record.get("user")
-            record["ueba_score"] = ueba_scores.get(user_id, 0.0)
+        user_stats["ueba_score"] = [ueba_scores.get(user_id, 0.0) for user_id in user_stats["user"]]
 
         # 3) Risk and fidelity scoring
-        user_records = compute_risk(user_records)
+        user_stats = compute_risk(user_stats)
 
         # 4) Cross-entity correlation
-        user_records = correlate_patterns(user_records)
+        user_stats = correlate_patterns(user_stats)
 
-        # 5) Attach playbooks
+        # 5) Attach playbooks; records are only materialised here, at the response boundary
+        user_records = user_stats.to_dict(orient="records")
         for record in user_records:
             record["playbook"] = generate_playbook(record)
 
-        return {
-            "total_users": len(user_records),
-            "analysis": user_records,
-        }
+        # Return the response directly so the large analysis list skips jsonable_encoder
+        return ORJSONResponse(
+            {
+                "total_users": len(user_records),
+                "analysis": user_records,
+            }
+        )
     except Exception as e:
         return JSONResponse(
             status_code=500,
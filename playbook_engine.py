@@ -1,34 +1,44 @@
+import math
 import os
 from concurrent.futures import TimeoutError as FuturesTimeoutError
 from concurrent.futures import ThreadPoolExecutor
-from typing import Any, Dict, List
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
 
 # Max seconds to wait for Ollama; then fall back to rule-based playbook
 PLAYBOOK_LLM_TIMEOUT = int(os.getenv("PLAYBOOK_LLM_TIMEOUT", "20"))
 # Set to "1", "true", "yes" to use Ollama for playbooks; default off so /analyze returns quickly
 USE_LLM_PLAYBOOK = os.getenv("USE_LLM_PLAYBOOK", "0").lower() in ("1", "true", "yes")
 
+# Shared pool for time-bounded LLM calls; reused across playbooks instead of per call
+_LLM_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="playbook-llm")
 
-def _rule_based_playbook(context: Dict[str, Any]) -> Dict[str, Any]:
-    """
-    Fallback playbook when LLM / LangGraph is not available.
-    Still produces deterministic and explainable guidance.
+
+def _score_band(score: float) -> int:
+    if math.isfinite(score):
+        return int(score // 10)
+    # NaN and -inf fail every threshold comparison (band 0); +inf passes them all
+    return 10 if score > 0 else 0
+
+
+@lru_cache(maxsize=256)
+def _rule_based_template(risk_band: int, fidelity_band: int, ueba_band: int) -> Tuple[str, Tuple[str, ...]]:
     """
-    user = context.get("user") or context.get("primary_user") or "unknown"
-    risk_score = float(context.get("risk_score", 0.0) or 0.0)
-    fidelity_score = float(context.get("fidelity_score", 0.0) or 0.0)
-    ueba_score = float(context.get("signals", {}).get("ueba_score", 0.0) or 0.0)
+    Severity and steps for a (risk, fidelity, UEBA) band triple.
 
+    Bands are score // 10 and every threshold below is a multiple of 10, so
+    the band alone decides each branch and many users share one cached entry.
+    """
     steps: List[str] = []
 
-    if risk_score >= 80 or fidelity_score >= 80:
+    if risk_band >= 8 or fidelity_band >= 8:
         severity = "Critical"
         steps.append("1. Immediately disable user access to high-risk banking systems.")
         steps.append("2. Trigger emergency authentication reset for the user.")
         steps.append("3. Capture volatile artefacts from endpoints (EDR snapshots, memory).")
         steps.append("4. Search SIEM for lateral movement and payment-related activity.")
         steps.append("5. Notify cyber operations lead and fraud monitoring team.")
-    elif risk_score >= 50:
+    elif risk_band >= 5:
         severity = "High"
         steps.append("1. Enforce password reset and step-up MFA for the user.")
         steps.append("2. Review last 24 hours of SWIFT/core-banking and payment activity.")
@@ -40,16 +50,33 @@ def _rule_based_playbook(context: Dict[str, Any]) -> Dict[str, Any]:
         steps.append("2. Review access patterns for unusual devices or geolocations.")
         steps.append("3. Educate user on secure behaviour (phishing, password hygiene).")
 
-    if ueba_score >= 70:
+    if ueba_band >= 7:
         steps.append(
             "6. UEBA indicates strong behavioural deviation – extend investigation to peer group."
         )
 
+    return severity, tuple(steps)
+
+
+def _rule_based_playbook(context: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Fallback playbook when LLM / LangGraph is not available.
+    Still produces deterministic and explainable guidance.
+    """
+    user = context.get("user") or context.get("primary_user") or "unknown"
+    risk_score = float(context.get("risk_score", 0.0) or 0.0)
+    fidelity_score = float(context.get("fidelity_score", 0.0) or 0.0)
+    ueba_score = float(context.get("signals", {}).get("ueba_score", 0.0) or 0.0)
+
+    severity, steps = _rule_based_template(
+        _score_band(risk_score), _score_band(fidelity_score), _score_band(ueba_score)
+    )
+
     return {
         "severity": severity,
         "summary": f"{severity} risk activity detected for user {user}",
         "recommended_action": steps[0],
-        "steps": steps,
+        "steps": list(steps),
         "strategy": "rule_based",
     }
 
@@ -215,9 +242,8 @@ def generate_playbook(user_or_incident: Dict[str, Any]) -> Dict[str, Any]:
         return _llm_playbook(user_or_incident)
 
     try:
-        with ThreadPoolExecutor(max_workers=1) as ex:
-            future = ex.submit(_run_llm)
-            return future.result(timeout=PLAYBOOK_LLM_TIMEOUT)
+        future = _LLM_EXECUTOR.submit(_run_llm)
+        return future.result(timeout=PLAYBOOK_LLM_TIMEOUT)
     except (FuturesTimeoutError, Exception):
         # Timeout or any LLM error: never hang the pipeline
         return _rule_based_playbook(user_or_incident)
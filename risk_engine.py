@@ -1,38 +1,19 @@
-from typing import Dict, List
+import numpy as np
+import pandas as pd
+from numba import njit
 
 
-def compute_risk(user_records: List[Dict]) -> List[Dict]:
-    """
-    Attach risk and fidelity scores to each user's  aggregated record.
-
-    Risk score:
-        - Driven by anomaly score from PyOD, failed  logins, and after-hours activity
-        - Optionally boosted by UEBA score if present
-
-    Fidelity score:
-        - How confident we are that this is a *true* security issue
-        - Increases when multiple independent signals fire (failed logins,
-          after-hours, UEBA anomaly, PyOD anomaly )
-    """
-
-    enriched_records: List[Dict] = []
-
-    for record in user_records:
-        failed = int(record.get("failed_login", 0) or 0)
-        login = int(record.get("login", 0) or 0)
-        after_hours = int(record.get("after_hours", 0) or 0)
-        anomaly_score = float(record.get("anomaly_score", 0.0) or 0.0)
-        is_anomaly = int(record.get("is_anomaly", 0) or 0)
-        ueba_score = float(record.get("ueba_score", 0.0) or 0.0)
-
+@njit(fastmath=True, cache=True)
+def _score_kernel(failed, after_hours, anomaly_score, is_anomaly, ueba_score, out_risk, out_fidelity):
+    for i in range(failed.shape[0]):
         # Base risk from anomaly score (normalised) and UEBA
-        base = max(anomaly_score, 0.0)
-        behavioural = ueba_score / 2.0  # dampen UEBA contribution slightly
+        base = max(anomaly_score[i], 0.0)
+        behavioural = ueba_score[i] / 2.0  # dampen UEBA contribution slightly
 
         # Heuristic multipliers for security-relevant behaviours
-        failed_component = failed * 6
-        after_hours_component = after_hours * 4
-        anomaly_flag_component = 12 if is_anomaly else 0
+        failed_component = failed[i] * 6.0
+        after_hours_component = after_hours[i] * 4.0
+        anomaly_flag_component = 12.0 if is_anomaly[i] != 0 else 0.0
 
         raw_risk = (
             base
@@ -43,34 +24,84 @@ def compute_risk(user_records: List[Dict]) -> List[Dict]:
         )
 
         # Clamp to a clean 0–100 scale
-        risk_score = max(0.0, min(raw_risk, 100.0))
+        out_risk[i] = max(0.0, min(raw_risk, 100.0))
 
         # Fidelity measures how many *independent* signals agree
         signal_count = 0
-        if failed > 0:
+        if failed[i] > 0:
             signal_count += 1
-        if after_hours > 0:
+        if after_hours[i] > 0:
             signal_count += 1
-        if ueba_score >= 50:
+        if ueba_score[i] >= 50:
             signal_count += 1
-        if is_anomaly:
+        if is_anomaly[i] != 0:
             signal_count += 1
 
         # Start with a conservative baseline and grow with each corroborating signal
-        fidelity_score = 30.0 + signal_count * 15.0
-        fidelity_score = max(0.0, min(fidelity_score, 99.0))
-
-        record["risk_score"] = float(risk_score)
-        record["fidelity_score"] = float(fidelity_score)
-        record["signals"] = {
-            "failed_login": failed,
-            "login": login,
-            "after_hours": after_hours,
-            "ueba_score": ueba_score,
-            "is_anomaly": bool(is_anomaly),
-        }
+        out_fidelity[i] = max(0.0, min(30.0 + signal_count * 15.0, 99.0))
+
 
-        enriched_records.append(record)
+def numeric_column(user_stats: pd.DataFrame, name: str) -> np.ndarray:
+    """Contiguous float64 column with missing values (or a missing column) as 0."""
+    if name not in user_stats.columns:
+        return np.zeros(len(user_stats), dtype=np.float64)
+    values = pd.to_numeric(user_stats[name], errors="coerce").fillna(0.0)
+    return np.ascontiguousarray(values.to_numpy(dtype=np.float64))
 
-    return enriched_records
 
+def compute_risk(user_stats: pd.DataFrame) -> pd.DataFrame:
+    """
+    Attach risk and fidelity scores to each user's  aggregated record.
+
+    Risk score:
+        - Driven by anomaly score from PyOD, failed  logins, and after-hours activity
+        - Optionally boosted by UEBA score if present
+
+    Fidelity score:
+        - How confident we are that this is a *true* security issue
+        - Increases when multiple independent signals fire (failed logins,
+          after-hours, UEBA anomaly, PyOD anomaly )
+
+    Works on the per-user frame from `detect_anomalies`, adding
+    `risk_score`, `fidelity_score` and `signals` columns in place.
+    """
+
+    if user_stats.empty:
+        return user_stats
+
+    # Count-like signals are truncated to whole numbers (as int() did per record)
+    # but stay float64 so the kernel reads them without another copy
+    failed = np.trunc(numeric_column(user_stats, "failed_login"))
+    login = np.trunc(numeric_column(user_stats, "login"))
+    after_hours = np.trunc(numeric_column(user_stats, "after_hours"))
+    anomaly_score = numeric_column(user_stats, "anomaly_score")
+    is_anomaly = np.trunc(numeric_column(user_stats, "is_anomaly"))
+    ueba_score = numeric_column(user_stats, "ueba_score")
+
+    n = len(user_stats)
+    risk_scores = np.empty(n, dtype=np.float64)
+    fidelity_scores = np.empty(n, dtype=np.float64)
+    _score_kernel(
+        failed, after_hours, anomaly_score, is_anomaly, ueba_score, risk_scores, fidelity_scores
+    )
+
+    user_stats["risk_score"] = risk_scores
+    user_stats["fidelity_score"] = fidelity_scores
+    user_stats["signals"] = [
+        {
+            "failed_login": failed_i,
+            "login": login_i,
+            "after_hours": after_hours_i,
+            "ueba_score": ueba_i,
+            "is_anomaly": bool(is_anomaly_i),
+        }
+        for failed_i, login_i, after_hours_i, ueba_i, is_anomaly_i in zip(
+            failed.astype(np.int64).tolist(),
+            login.astype(np.int64).tolist(),
+            after_hours.astype(np.int64).tolist(),
+            ueba_score.tolist(),
+            is_anomaly.tolist(),
+        )
+    ]
+
+    return user_stats
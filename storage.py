@@ -1,85 +1,253 @@
+import asyncio
 import json
+import logging
 import os
-from typing import Dict, List, Optional
+import threading
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Set
 
-LOG_FILE = "ingested_logs.json"
+import aiofiles
+import orjson
+import pandas as pd
 
+LOG_FILE = "ingested_logs.ndjson"
+# Pre-NDJSON store (a single JSON array); converted to LOG_FILE on first use
+LEGACY_LOG_FILE = "ingested_logs.json"
 
-def _get_es_client():
+logger = logging.getLogger(__name__)
+
+# Bulk indexing tuning: flush once a batch is this large or the window elapses
+ES_BULK_CHUNK_SIZE = int(os.getenv("ES_BULK_CHUNK_SIZE", "1000"))
+ES_BULK_WINDOW_SECONDS = float(os.getenv("ES_BULK_WINDOW_SECONDS", "0.2"))
+# Max pending /ingest batches waiting for indexing before the API applies backpressure
+ES_INDEX_QUEUE_SIZE = int(os.getenv("ES_INDEX_QUEUE_SIZE", "10000"))
+
+# HTTP connections kept per Elasticsearch node by the shared client
+ES_CONNECTIONS_PER_NODE = int(os.getenv("ES_CONNECTIONS_PER_NODE", "25"))
+
+_ES_CLIENT = None
+_ES_LOCK = threading.Lock()
+_PREPARED_INDICES: Set[str] = set()
+
+_MIGRATION_LOCK = threading.Lock()
+_migration_checked = False
+
+
+def es_indexing_enabled() -> bool:
+    return os.getenv("ENABLE_ELASTICSEARCH", "").lower() in {"1", "true", "yes"}
+
+
+def get_es_client():
     """
-    Lazily create an Elasticsearch client if explicitly enabled via env.
+    Lazily create an async Elasticsearch client if explicitly enabled via env.
 
-    This keeps the default behaviour fully local (JSON file storage),
+    This keeps the default behaviour fully local (NDJSON file storage),
     while allowing optional indexing into a local Elasticsearch cluster
     for richer search and correlation.
+
+    The client is built once and shared so its connection pool keeps
+    keep-alive connections open between bulk requests.
     """
-    enable_es = os.getenv("ENABLE_ELASTICSEARCH", "").lower() in {"1", "true", "yes"}
-    if not enable_es:
-        return None
+    global _ES_CLIENT
 
-    try:
-        from elasticsearch import Elasticsearch  # type: ignore
-    except Exception:
+    if _ES_CLIENT is not None:
+        return _ES_CLIENT
+
+    if not es_indexing_enabled():
         return None
 
-    es_url = os.getenv("ELASTICSEARCH_URL", "http://localhost:9200")
+    with _ES_LOCK:
+        if _ES_CLIENT is not None:
+            return _ES_CLIENT
 
-    try:
-        client = Elasticsearch(es_url, request_timeout=2)
-    except Exception:
-        return None
+        try:
+            from elasticsearch import AsyncElasticsearch  # type: ignore
+        except Exception:
+            return None
+
+        es_url = os.getenv("ELASTICSEARCH_URL", "http://localhost:9200")
+
+        try:
+            _ES_CLIENT = AsyncElasticsearch(
+                es_url,
+                request_timeout=10,
+                http_compress=True,
+                connections_per_node=ES_CONNECTIONS_PER_NODE,
+            )
+        except Exception:
+            return None
 
-    return client
+    return _ES_CLIENT
 
 
-def _index_logs_in_elasticsearch(logs: List[Dict]) -> None:
-    client = _get_es_client()
-    if not client:
+async def _close_es_client() -> None:
+    global _ES_CLIENT
+
+    with _ES_LOCK:
+        client, _ES_CLIENT = _ES_CLIENT, None
+
+    if client is not None:
+        await client.close()
+
+
+async def _ensure_log_index(client, index_name: str) -> None:
+    """
+    Create the log index with ingest-friendly settings on first use.
+
+    Async translog durability and a relaxed refresh interval let bulk
+    requests avoid an fsync and segment refresh per batch.
+    """
+    if index_name in _PREPARED_INDICES:
         return
 
+    try:
+        if not await client.indices.exists(index=index_name):
+            await client.indices.create(
+                index=index_name,
+                settings={
+                    "index.translog.durability": "async",
+                    "index.refresh_interval": "30s",
+                },
+            )
+    except Exception:
+        # Index may already exist (race) or cluster may reject settings; bulk still works
+        pass
+
+    _PREPARED_INDICES.add(index_name)
+
+
+async def _bulk_index(client, logs: List[Dict]) -> None:
     try:
         from elasticsearch import helpers  # type: ignore
     except Exception:
         return
 
     index_name = os.getenv("ES_LOG_INDEX", "barclays-security-logs")
+    await _ensure_log_index(client, index_name)
 
-    actions = [
-        {
-            "_index": index_name,
-            "_op_type": "index",
-            "_source": log,
-        }
-        for log in logs
-    ]
+    async def _actions() -> AsyncIterator[Dict]:
+        for log in logs:
+            yield {
+                "_index": index_name,
+                "_op_type": "index",
+                "_source": log,
+            }
 
     try:
-        helpers.bulk(client, actions, raise_on_error=False)
+        await helpers.async_bulk(
+            client,
+            _actions(),
+            chunk_size=ES_BULK_CHUNK_SIZE,
+            raise_on_error=False,
+        )
     except Exception:
         # Elasticsearch is optional; failures must not impact the agent
         return
 
 
-def save_logs(logs: List[Dict]) -> None:
-    if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, "r") as f:
-            existing = json.load(f)
-    else:
-        existing = []
+async def run_index_worker(queue: "asyncio.Queue[List[Dict]]", client) -> None:
+    """
+    Drain ingested log batches from `queue` into Elasticsearch via `client`.
+
+    Batches are coalesced until ES_BULK_CHUNK_SIZE documents are pending or
+    ES_BULK_WINDOW_SECONDS has passed since the first one arrived, so bursts
+    of small /ingest calls become a few bulk requests.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            batch = list(await queue.get())
+            deadline = loop.time() + ES_BULK_WINDOW_SECONDS
+            while len(batch) < ES_BULK_CHUNK_SIZE:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.extend(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            await _bulk_index(client, batch)
+    finally:
+        await _close_es_client()
+
+
+def _migrate_legacy_log_file() -> None:
+    """
+    One-time conversion of a legacy JSON-array store into NDJSON.
+
+    Runs only when LEGACY_LOG_FILE exists and LOG_FILE does not; the legacy
+    file is left in place. The NDJSON file is written to a temp path and
+    renamed so a failed conversion never leaves a partial store behind.
+    """
+    global _migration_checked
 
-    existing.extend(logs)
+    if _migration_checked:
+        return
 
-    with open(LOG_FILE, "w") as f:
-        json.dump(existing, f, indent=2)
+    with _MIGRATION_LOCK:
+        if _migration_checked:
+            return
+        _migration_checked = True
+
+        if not os.path.exists(LEGACY_LOG_FILE) or os.path.exists(LOG_FILE):
+            return
+
+        try:
+            with open(LEGACY_LOG_FILE, "r") as f:
+                legacy_logs = json.load(f)
+            tmp_path = LOG_FILE + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(b"".join(orjson.dumps(log) + b"\n" for log in legacy_logs))
+            os.replace(tmp_path, LOG_FILE)
+        except Exception:
+            logger.warning(
+                "Could not migrate legacy log store %s to %s; previously stored logs are not loaded",
+                LEGACY_LOG_FILE,
+                LOG_FILE,
+                exc_info=True,
+            )
+            return
+
+        logger.warning(
+            "Migrated %d logs from legacy store %s to %s", len(legacy_logs), LEGACY_LOG_FILE, LOG_FILE
+        )
+
+
+async def save_logs(logs: List[Dict]) -> None:
+    # Append-only NDJSON: each ingest writes only its own records, as a single
+    # buffered write so concurrent ingests never interleave partial lines
+    _migrate_legacy_log_file()
+    if logs:
+        payload = b"".join(orjson.dumps(log) + b"\n" for log in logs)
+        async with aiofiles.open(LOG_FILE, "ab") as f:
+            await f.write(payload)
+
+
+def iter_logs() -> Iterator[Dict]:
+    """Stream stored logs one record at a time without materialising the file."""
+    _migrate_legacy_log_file()
+    if not os.path.exists(LOG_FILE):
+        return
 
-    # Optionally index into local Elasticsearch for fast correlation/search
-    _index_logs_in_elasticsearch(logs)
+    with open(LOG_FILE, "rb") as f:
+        for line in f:
+            if line.strip():
+                yield orjson.loads(line)
 
 
 def load_logs() -> List[Dict]:
-    if not os.path.exists(LOG_FILE):
-        return []
+    return list(iter_logs())
+
 
-    with open(LOG_FILE, "r") as f:
-        return json.load(f)
+def load_logs_frame() -> pd.DataFrame:
+    """
+    Load stored logs straight into a DataFrame using pandas' C NDJSON reader.
+
+    Values are kept exactly as ingested (no dtype or date inference), so the
+    frame matches what `pd.DataFrame(load_logs())` would produce.
+    """
+    _migrate_legacy_log_file()
+    if not os.path.exists(LOG_FILE) or os.path.getsize(LOG_FILE) == 0:
+        return pd.DataFrame()
 
+    return pd.read_json(LOG_FILE, lines=True, dtype=False, convert_dates=False)
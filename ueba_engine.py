@@ -1,8 +1,11 @@
+import os
+
+import numpy as np
 import pandas as pd
-from typing import Dict, List
+from typing import Dict, List, Union
 
 
-def compute_ueba_scores(logs: List[dict]) -> Dict[str, float]:
+def compute_ueba_scores(logs: Union[List[dict], pd.DataFrame]) -> Dict[str, float]:
     """
     Compute per-user UEBA (User and Entity Behaviour Analytics) scores.
 
@@ -16,48 +19,49 @@ def compute_ueba_scores(logs: List[dict]) -> Dict[str, float]:
     where higher values indicate more anomalous behaviour.
     """
 
-    if not logs:
+    if len(logs) == 0:
         return {}
 
-    df = pd.DataFrame(logs)
+    # Accept either raw log dicts or a DataFrame already loaded from storage
+    df = logs.copy() if isinstance(logs, pd.DataFrame) else pd.DataFrame(logs)
 
     if "user" not in df.columns or "timestamp" not in df.columns:
         # Fallback: cannot compute UEBA without core fields
         return {}
 
-    df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
+    df["timestamp"] = pd.to_datetime(df["timestamp"], format="ISO8601", errors="coerce", utc=True)
     df = df.dropna(subset=["timestamp"])
 
     if df.empty:
         return {}
 
     # Map event types to a simple numeric "behaviour weight"
-    def event_weight(event: str) -> int:
-        event = (event or "").lower()
-        if "fail" in event or "denied" in event or "error" in event:
-            return 3
-        if "privilege" in event or "admin" in event or "policy" in event:
-            return 2
-        return 1
-
-    event_col = df["event_type"].fillna("").astype(str) if "event_type" in df.columns else pd.Series(["1"] * len(df))
-    df["value"] = event_col.apply(lambda e: event_weight(e))
+    if "event_type" in df.columns:
+        event_str = df["event_type"].fillna("").astype(str).str.lower()
+    else:
+        event_str = pd.Series([""] * len(df), index=df.index)
+    high_weight = event_str.str.contains("fail|denied|error", regex=True)
+    mid_weight = event_str.str.contains("privilege|admin|policy", regex=True)
+    df["value"] = np.where(high_weight, 3, np.where(mid_weight, 2, 1))
     df["id"] = df["user"]
 
     # tsfresh expects columns: id, time, value
     ts_df = df[["id", "timestamp", "value"]].rename(columns={"timestamp": "time"})
 
     try:
-        from tsfresh.feature_extraction import extract_features
+        from tsfresh.feature_extraction import MinimalFCParameters, extract_features
     except ImportError:
         return {}
 
-    # Extract a compact set of time-series features per user
+    # Extract a compact set of time-series features per user; the minimal
+    # parameter set keeps extraction to ~10 features instead of several hundred
     try:
         features = extract_features(
             ts_df,
             column_id="id",
             column_sort="time",
+            default_fc_parameters=MinimalFCParameters(),
+            n_jobs=max(1, (os.cpu_count() or 2) - 1),
             disable_progressbar=True,
         )
     except Exception:
@@ -79,18 +83,14 @@ def compute_ueba_scores(logs: List[dict]) -> Dict[str, float]:
     except Exception:
         return {}
 
-    max_score = float(scores.max()) if len(scores) else 1.0
-    min_score = float(scores.min()) if len(scores) else 0.0
-
-    ueba_scores: Dict[str, float] = {}
+    # Min-max normalise onto a 0–100 scale
+    scores = np.asarray(scores, dtype=np.float64)
+    min_score, max_score = scores.min(), scores.max()
+    if max_score == min_score:
+        norm = np.zeros_like(scores)
+    else:
+        norm = (scores - min_score) / (max_score - min_score) * 100.0
 
-    for idx, (user_id, _) in enumerate(features.iterrows()):
-        raw = float(scores[idx])
-        if max_score == min_score:
-            norm = 0.0
-        else:
-            norm = (raw - min_score) / (max_score - min_score)
-        ueba_scores[str(user_id)] = float(norm * 100.0)  # 0–100 scale
+    ueba_scores: Dict[str, float] = dict(zip(features.index.astype(str), norm.tolist()))
 
     return ueba_scores
-